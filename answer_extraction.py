@@ -5,15 +5,27 @@ import json
 openai.api_key = os.getenv("OPENAI_API_KEY")  # or directly assign the key here
 import pydantic
 import sys
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
 import asyncio
-from  extraction import extract_multiple_pages_async
+from  extraction import extract_multiple_pages_async, close_http_client
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-app = FastAPI()
+from contextlib import asynccontextmanager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Python 3.12+: run new tasks up to their first await without a scheduler round-trip
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    yield
+    await close_http_client()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,28 +36,38 @@ app.add_middleware(
 )
 client =OpenAI()
 
+
 # Your question definitions
-QUESTION_IDS = [
+QUESTION_IDS = (
     "fullName", "address", "loanType", "loanAmount", "emiComfort", "monthlyObligations",
     "incomeSource", "salaryAmount", "designationEmployer", "otherIncomeSources",
     "businessRevenue", "businessProfit", "businessSalary",
     "atPropertyLocation", "propertyAddress", "propertyType", "propertyStructure",
     "propertyUsage", "landArea", "marketValue", "existingLoan", "existingLoanEmi"
-]
+)
 
-# class ConversationItem(BaseModel):
-#     id: str
-#     role: str
-#     message: str
+class ConversationItem(BaseModel):
+    # Only role and message are used; other keys such as id are ignored
+    model_config = ConfigDict(extra="ignore")
+
+    role: str
+    message: str
 
 # class TranscriptRequest(BaseModel):
 #     conversations: List[ConversationItem]
 
+# Precomputed speaker prefixes for the common roles
+_ROLE_PREFIXES = {"bot": "Bot: ", "user": "User: "}
+
 def format_transcript(conversations):
-    return "\n".join(f"{c['role'].capitalize()}: {c['message']}" for c in conversations)
+    prefixes = _ROLE_PREFIXES
+    return "\n".join([
+        f"{prefixes.get(c.role) or c.role.capitalize() + ': '}{c.message}"
+        for c in conversations
+    ])
 
 @app.post("/summarize")
-async def summarize_transcript(request: List[dict]):
+async def summarize_transcript(request: List[ConversationItem]):
     try:
         formatted_text = format_transcript(request)
         json_output = await extract_multiple_pages_async(
@@ -55,7 +77,7 @@ async def summarize_transcript(request: List[dict]):
         )
         json_output.pop("page", None)
 
-        return JSONResponse(content=json_output["response"][0])
+        return json_output["response"][0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -90,7 +112,7 @@ if __name__ == "__main__":
 
     if "--run" in sys.argv:
         async def test_summary():
-            formatted = format_transcript(conversations)
+            formatted = format_transcript([ConversationItem(**c) for c in conversations])
             result = await extract_multiple_pages_async(
                 input_type="TEXT",
                 file_name="test_convo",
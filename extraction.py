@@ -1,23 +1,110 @@
-from openai import AsyncOpenAI
-import json
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAIError
+import httpx
+import orjson
 import asyncio
-from aiolimiter import AsyncLimiter
+import time
 from prompt_processing import generate_prompt_template, generate_prompt_from_schema, PromptSchema
-from extraction_class_type import ExtractionClass, AIAgentClass, OutputExampleClass
-from file_process import base_64_conversation
+from extraction_class_type import ExtractionClass, BatchExtraction, AIAgentClass, OutputExampleClass
+from file_process import cached_base_64_conversation
 from landing_ai_parse import landing_ai_vision_parser, retrieve_page_wise_parse
 from constants import (
     OPENAI_API_KEY,
     OPEN_AI_EXTRACTION_MODEL,
-    OPEN_AI_PARSE_FORMATING_MODEL,
     ASYNC_OPENAI_RATE_LIMIT,
     ASYNC_OPEN_AI_TIME_PERIOD,
     ASYNC_CONCURRENCY_LIMIT
 )
 
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-rate_limiter = AsyncLimiter(max_rate=ASYNC_OPENAI_RATE_LIMIT, time_period=ASYNC_OPEN_AI_TIME_PERIOD)
+class TokenBucketLimiter:
+    """
+    Token-bucket rate limiter; call `await limiter.acquire()` before each request.
+
+    The wait for a token is computed while holding a short lock and the sleep happens
+    after releasing it, so callers wait concurrently instead of queueing behind a
+    single sleeping waiter.
+
+    Args:
+        max_rate (float): Number of tokens allowed per `time_period`.
+        time_period (float): Length of the rate window in seconds.
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 60):
+        self.max_rate = max_rate
+        self.rate = max_rate / time_period
+        self._tokens = float(max_rate)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Reserve the token up front; a negative balance is the queue of pending waiters
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Give the reserved token back so cancelled waiters don't delay later callers
+                async with self._lock:
+                    self._tokens += 1
+                raise
+
+
+# Explicitly sized pool; HTTP/2 multiplexes concurrent requests over fewer connections.
+# DefaultAsyncHttpxClient keeps the SDK defaults (600s read timeout, redirects) that
+# large page images and whole-document batches rely on.
+http_client = DefaultAsyncHttpxClient(
+    limits=httpx.Limits(
+        max_connections=ASYNC_CONCURRENCY_LIMIT * 2,
+        max_keepalive_connections=ASYNC_CONCURRENCY_LIMIT * 2,
+    ),
+    http2=True,
+)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+rate_limiter = TokenBucketLimiter(max_rate=ASYNC_OPENAI_RATE_LIMIT, time_period=ASYNC_OPEN_AI_TIME_PERIOD)
+_IMG_TYPES = frozenset({"PDF", "IMAGE"})
+# Caps in-flight LLM calls across all requests, independently of the RPS limiter
+_INFLIGHT = asyncio.Semaphore(ASYNC_CONCURRENCY_LIMIT)
+
+# The prompt only depends on the static extraction classes, so build it once at import
+_SCHEMA_DICT = PromptSchema(
+    ai_agent_information=generate_prompt_template(AIAgentClass),
+    extract_fields=generate_prompt_template(ExtractionClass),
+    output_example=generate_prompt_template(OutputExampleClass),
+).model_dump()
+_PROMPT = generate_prompt_from_schema(_SCHEMA_DICT)
+
+# Constant parts of the extraction request, shared across calls
+_SYSTEM_MSG = {
+    "role": "system",
+    "content": [
+        { "type": "input_text", "text": "\n\n Extract the all fields from the input and return only valid JSON (no explanations or extra text):\n\n"}
+    ]
+}
+_USER_PROMPT_ITEM = { "type": "input_text", "text": _PROMPT}
+_BATCH_SYSTEM_MSG = {
+    "role": "system",
+    "content": [
+        { "type": "input_text", "text": "\n\n Each page below is preceded by its PAGE NUMBER. Extract the all fields from every page and return one extraction per page, in the same order as the pages, as valid JSON (no explanations or extra text):\n\n"}
+    ]
+}
+
+
+async def close_http_client() -> None:
+    """Closes the shared HTTP client used by the OpenAI client. Call on application shutdown."""
+    await http_client.aclose()
+
+
+def _write_json(output_path: str, data: dict) -> None:
+    """Serializes `data` as indented JSON to `output_path`. Blocking; run it via `asyncio.to_thread`."""
+    blob = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    with open(output_path, "wb") as f:
+        f.write(blob)
 
 
 async def limited_task(sem: asyncio.Semaphore, coro):
@@ -42,12 +129,14 @@ async def extract_fields_async(input_type: str = "PDF", base_64: str = "", text_
 
     Args:
         input_type (str): The type of input provided. Must be one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
-        base_64 (str): Base64-encoded string of the input image or PDF page (used if input_type is "PDF" or "IMAGE").
+        base_64 (str): Base64 data URL (`data:<mime>;base64,...`) of the input image or PDF page, as returned by
+            `base_64_conversation` (used if input_type is "PDF" or "IMAGE").
         text_input (str): Raw text input (used if input_type is "TEXT").
         page_number (int): Page number associated with the input, used for tracking multi-page documents.
 
     Returns:
         dict: A dictionary containing the parsed and extracted fields from the input, along with the page number.
+            Returns an empty dictionary if the model does not return a parsed result (e.g. a refusal).
 
     Raises:
         ValueError: If `input_type` is not one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
@@ -68,11 +157,11 @@ async def extract_fields_async(input_type: str = "PDF", base_64: str = "", text_
         print(result)
         ```
     """
-    if input_type in ["PDF", "IMAGE"]:
+    if input_type in _IMG_TYPES:
         # Convert PDF to base64 images
         content = {
             "type": "input_image",
-            "image_url": f"data:image/jpeg;base64,{base_64}",
+            "image_url": base_64,
         }
     elif input_type == "TEXT":
         # Encode text input to base64
@@ -83,93 +172,91 @@ async def extract_fields_async(input_type: str = "PDF", base_64: str = "", text_
     else:
         raise ValueError("Unsupported file type. Use 'PDF' or 'IMAGE'.")
     
-    extraction_template = generate_prompt_template(ExtractionClass)
-    ai_agent_template = generate_prompt_template(AIAgentClass)
-    output_example_template = generate_prompt_template(OutputExampleClass)
-
-    schema = PromptSchema(
-        ai_agent_information=ai_agent_template,
-        extract_fields=extraction_template,
-        output_example=output_example_template,
+    # The limiter only gates admission; the request itself runs outside of it
+    await rate_limiter.acquire()
+    # Structured output returns a validated ExtractionClass, so no JSON parsing/repair pass is needed
+    response = await client.responses.parse(
+        model=OPEN_AI_EXTRACTION_MODEL,
+        input=[
+            _SYSTEM_MSG,
+            {
+                "role": "user",
+                "content": [
+                    _USER_PROMPT_ITEM,
+                    { "type": "input_text", "text": f"PAGE NUMBER of the PDF: {page_number}"},
+                    content
+                ]
+            }
+        ],
+        text_format=ExtractionClass,
+        temperature=0.1,       
     )
 
-    prompt = generate_prompt_from_schema(schema.model_dump())
-
-    async with rate_limiter:
-        response = await client.responses.create(
-            model=OPEN_AI_EXTRACTION_MODEL,
-            input=[
-                {
-                    "role": "system",
-                    "content": [
-                        { "type": "input_text", "text": f"\n\n Extract the all fields from the input and return only valid JSON (no explanations or extra text):\n\n"}
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        { "type": "input_text", "text": prompt},
-                        { "type": "input_text", "text": f"PAGE NUMBER of the PDF: {page_number}"},
-                        content
-                    ]
-                }
-            ],
-            temperature=0.1,       
-        )
-
-    parsed_content = await parse_response_content(response.output_text)
+    parsed = response.output_parsed
+    parsed_content = parsed.model_dump() if isinstance(parsed, ExtractionClass) else {}
     # parsed_content["page"] = page_number
 
     print(f"Parsed content for page {page_number}")
     return parsed_content
 
 
-async def parse_response_content(response_content: str) -> dict:
+async def extract_pages_batched_async(input_type: str = "PDF", base64_images: list = [], text_inputs: list = []) -> list | None:
     """
-    Attempts to parse the response content into a valid JSON structure. If initial parsing fails,
-    it sends the content to a language model for correction into a structured format using the 
-    `ExtractionClass` schema.
+    Asynchronously extracts structured fields from all pages of a document with a single
+    structured-output request, instead of one request per page.
 
     Args:
-        response_content (str): The raw string content returned from the initial extraction response,
-            expected to be a JSON string or close to valid JSON.
+        input_type (str): The type of input provided. Must be one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
+        base64_images (list): A list of base64 data URLs, one per page. Used if
+            `input_type` is `"PDF"` or `"IMAGE"`.
+        text_inputs (list): List of plain text strings, one per page. Used if `input_type` is `"TEXT"`.
 
     Returns:
-        dict: A dictionary representation of the parsed content. If parsing via the model is successful, 
-            the corrected and validated structure is returned. Returns an empty dictionary on failure.
+        list | None: A list of dictionaries with the extracted fields, one per page in page order.
+            Returns None if the model does not return a parsed result or returns a different
+            number of extractions than input pages, so the caller can fall back to per-page extraction.
 
     Raises:
-        None
+        ValueError: If `input_type` is not one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
 
-    Example:
-        ```python
-        # If ExtractionClass is of type `{"name": "John", "age": 30}`
-        parsed = await parse_response_content('{"name": "John", "age": 30}')
-        print(parsed)  # {'name': 'John', 'age': 30}
-        ```
+    Note:
+        - Large documents may exceed the model's context window; use per-page extraction for those.
     """
-    try:
-        return json.loads(response_content)
-    except json.JSONDecodeError:
-        # Try to extract a JSON snippet from the response
-        async with rate_limiter:
-            response = await client.responses.parse(
-                model=OPEN_AI_PARSE_FORMATING_MODEL,
-                input=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert at structured data JSON creation. You will be given a text with almost like a JSON strucuture in text format from an extraction solution and your job would be to convert it to Valid JSON strcture provided below.",
-                    },
-                    {"role": "user", "content": f"{response_content}"},
-                ],
-                text_format=ExtractionClass,
-                temperature=0.1,
-            )
-
-        if response and isinstance(response, ExtractionClass):
-            return response
-        else:
-            return {}
+    if input_type in _IMG_TYPES:
+        page_contents = [{"type": "input_image", "image_url": base_64} for base_64 in base64_images]
+    elif input_type == "TEXT":
+        page_contents = [{"type": "input_text", "text": text} for text in text_inputs]
+    else:
+        raise ValueError("Unsupported file type. Use 'PDF', 'IMAGE', or 'TEXT'.")
+
+    if not page_contents:
+        return []
+
+    content = [_USER_PROMPT_ITEM]
+    for page_number, page_content in enumerate(page_contents):
+        content.append({"type": "input_text", "text": f"PAGE NUMBER of the PDF: {page_number}"})
+        content.append(page_content)
+
+    async with _INFLIGHT:
+        # Take the token only once a slot is free, matching the per-page path
+        await rate_limiter.acquire()
+        response = await client.responses.parse(
+            model=OPEN_AI_EXTRACTION_MODEL,
+            input=[_BATCH_SYSTEM_MSG, {"role": "user", "content": content}],
+            text_format=BatchExtraction,
+            temperature=0.1,
+        )
+
+    parsed = response.output_parsed
+    if not isinstance(parsed, BatchExtraction):
+        return None
+    if len(parsed.pages) != len(page_contents):
+        # Results can't be mapped back to pages reliably
+        print(f"Batched extraction returned {len(parsed.pages)} pages for {len(page_contents)} inputs")
+        return None
+
+    print(f"Parsed content for {len(parsed.pages)} pages in one request")
+    return [page.model_dump() for page in parsed.pages]
 
 
 async def extract_multiple_pages_async(input_type: str="", file_name: str="", base64_images: list=[], text_inputs: list=[], combine_pages: bool=False) -> dict:
@@ -180,11 +267,12 @@ async def extract_multiple_pages_async(input_type: str="", file_name: str="", ba
 
     Args:
         input_type (str): The type of input provided. Must be one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
-        base64_images (list): A list of base64-encoded image strings, one per page. Required if 
+        base64_images (list): A list of base64 data URLs, one per page. Required if 
             `input_type` is `"PDF"` or `"IMAGE"`.
         text_inputs (list): List of plain text strings used when `input_type` is `"TEXT"`.
-        combine_pages (bool): Currently unused. If set to `True`, it can be used to combine all 
-            base64 images into one document and extract at once. Default is `False`.
+        combine_pages (bool): If set to `True`, all pages are sent in a single request and extracted
+            at once (see `extract_pages_batched_async`), falling back to per-page extraction if the
+            batched request fails or does not return one entry per page. Default is `False`.
 
     Returns:
         dict: A dictionary with a `"response"` key containing a list of extracted data for each page.
@@ -192,41 +280,56 @@ async def extract_multiple_pages_async(input_type: str="", file_name: str="", ba
 
     Raises:
         ValueError: If `input_type` is not one of `"PDF"`, `"IMAGE"`, or `"TEXT"`.
+        Exception: The first error raised by any page; the remaining pages are cancelled and
+            no partial results are returned.
 
     Example:
         ```python
         response = await extract_multiple_pages_async(
             input_type="PDF",
-            base64_images=["<base64_str_page1>", "<base64_str_page2>"]
+            base64_images=["data:image/png;base64,<page1>", "data:image/png;base64,<page2>"]
         )
         print(response["response"][0])  # Parsed result from page 1
         ```
     """
     final_response = {"response": [], "file_name": file_name}
-    
-    if False:
-        combined_base64 = "".join(base64_images)
-        base64_images = [combined_base64]
-    
-    tasks = []
-    if input_type in ["PDF", "IMAGE"]:
+
+    if combine_pages:
+        try:
+            batched_response = await extract_pages_batched_async(input_type=input_type, base64_images=base64_images, text_inputs=text_inputs)
+        except OpenAIError as e:
+            # e.g. the whole document overflowing the context window or the output token limit
+            print(f"Batched extraction failed, falling back to per-page extraction: {e}")
+            batched_response = None
+        if batched_response is not None:
+            final_response["response"] = batched_response
+            return final_response
+        # Fall through to per-page extraction when the batch can't be trusted
+
+    page_coros = []
+    if input_type in _IMG_TYPES:
 
         for idx, base64_image in enumerate(base64_images):
-            tasks.append(extract_fields_async(input_type=input_type, base_64=base64_image, page_number=idx))
+            page_coros.append(limited_task(_INFLIGHT, extract_fields_async(input_type=input_type, base_64=base64_image, page_number=idx)))
     elif input_type == "TEXT":
         for idx, text in enumerate(text_inputs):
-            tasks.append(extract_fields_async(input_type=input_type, text_input=text, page_number=idx))
+            page_coros.append(limited_task(_INFLIGHT, extract_fields_async(input_type=input_type, text_input=text, page_number=idx)))
     else:
         raise ValueError("Unsupported file type. Use 'PDF', 'IMAGE', or 'TEXT'.")
     
-    results = await asyncio.gather(*tasks)
-    for result in results:
-        final_response["response"].append(result)
+    # A failing page cancels its siblings instead of leaving them running
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(coro) for coro in page_coros]
+    except ExceptionGroup as eg:
+        # Surface the page's own error (e.g. openai.APIError) rather than the group wrapper
+        raise eg.exceptions[0] from None
+    final_response["response"] = [task.result() for task in tasks]
 
     return final_response    
     
 
-async def extract_multiple_pdfs(input_paths: list[str], output_paths: list[str], parser: bool = False, save_parse: bool = False, parsing_json_dir_path: str = ""):
+async def extract_multiple_pdfs(input_paths: list[str], output_paths: list[str], parser: bool = False, save_parse: bool = False, parsing_json_dir_path: str = "", combine_pages: bool = False):
     """
     Asynchronously extracts structured data from multiple PDF documents using either direct
     image-based extraction or a pre-parsing text method. This function limits the number of
@@ -238,6 +341,8 @@ async def extract_multiple_pdfs(input_paths: list[str], output_paths: list[str],
         parser (bool, optional): If True, uses a parsing model to extract structured text before field extraction.
         save_parse (bool, optional): If True and parser is enabled, saves parsed results to disk.
         parsing_json_dir_path (str, optional): Directory path where parsed results will be saved if `save_parse` is True.
+        combine_pages (bool, optional): If True, extracts all pages of each PDF in a single request
+            (see `extract_multiple_pages_async`).
 
     Returns:
         list[dict]: A list of dictionaries, each representing the extracted results for a PDF.
@@ -265,19 +370,25 @@ async def extract_multiple_pdfs(input_paths: list[str], output_paths: list[str],
             page_level_text = retrieve_page_wise_parse(parsed_result=pdf)
 
             pdf_name = pdf_path.split("/")[-1]
-            tasks.append(limited_task(sem, extract_multiple_pages_async(input_type="TEXT", file_name=pdf_name, text_inputs=page_level_text)))
+            tasks.append(limited_task(sem, extract_multiple_pages_async(input_type="TEXT", file_name=pdf_name, text_inputs=page_level_text, combine_pages=combine_pages)))
     else:
-        for pdf_path in input_paths:
-            base64_images = base_64_conversation(input_type="PDF", file_path=pdf_path)
-
-            pdf_name = pdf_path.split("/")[-1]
-            tasks.append(limited_task(sem, extract_multiple_pages_async(input_type="PDF", file_name=pdf_name, base64_images=base64_images)))
+        try:
+            for pdf_path in input_paths:
+                # PDF rasterization is CPU/disk bound; keep it off the event loop
+                base64_images = await asyncio.to_thread(cached_base_64_conversation, input_type="PDF", file_path=pdf_path)
+
+                pdf_name = pdf_path.split("/")[-1]
+                # Start extracting this PDF right away so its LLM calls overlap with rasterizing the next one
+                tasks.append(asyncio.create_task(limited_task(sem, extract_multiple_pages_async(input_type="PDF", file_name=pdf_name, base64_images=base64_images, combine_pages=combine_pages))))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
     
     multi_pdf_extraction_result = await asyncio.gather(*tasks)
     
     for pdf_extraction, output_path in zip(multi_pdf_extraction_result, output_paths):
-        with open(output_path, "w") as f:
-            json.dump(pdf_extraction, f, indent=2)
+        await asyncio.to_thread(_write_json, output_path, pdf_extraction)
 
     return multi_pdf_extraction_result
 
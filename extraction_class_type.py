@@ -9,7 +9,7 @@ headers and other specific extraction details. You must define the pydantic clas
 the solution for extraction.
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
 
 
@@ -19,6 +19,8 @@ class AIAgentClass(BaseModel):
     condition: str = Field(..., description="Make Sure to extract the relevant answers. Example: If the user says `Mera naam Rajesh Kumar hai`, then extract the name as `Rajesh Kumar`. If the user does not provide any information for a field, then set that field to `NA` (Even if the field type is other than string). This applies to all the fields.")
 
 class ExtractionClass(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     fullName: str = Field(..., description="Full name of the user")
     address: str = Field(..., description="Detailed address of the user")
     loanType: str = Field(..., description="Type of loan requested by the user")
@@ -43,12 +45,17 @@ class ExtractionClass(BaseModel):
     existingLoanEmi: str = Field(..., description="EMI of the existing loan on the property if applicable")
 
 
+class BatchExtraction(BaseModel):
+    pages: List[ExtractionClass] = Field(..., description="One extraction per input page, in the same order as the pages")
+
+
 class OutputExampleClass(BaseModel):
     """Example Output"""
 
 
 __all__ = [
     "ExtractionClass",
+    "BatchExtraction",
     "AIAgentClass",
     "OutputExampleClass"
 ]
\ No newline at end of file
@@ -1,6 +1,11 @@
 import fitz
 import os
 import base64
+import hashlib
+import mimetypes
+import tempfile
+import orjson
+from constants import BASE64_CACHE_DIR
 
 
 def encode_image(image_path: str) -> str:
@@ -32,16 +37,17 @@ def encode_image(image_path: str) -> str:
 
 def to_base64(pdf_path: str) -> list:
     """
-    Converts each page of a PDF file into a base64-encoded PNG image.
+    Converts each page of a PDF file into a base64-encoded PNG image data URL.
 
     This function reads the input PDF file, renders each page as a high-resolution
-    image (300 DPI), and encodes each page as a base64 string in PNG format.
+    image (300 DPI), and encodes each page as a `data:image/png;base64,...` string that
+    can be passed to the model as-is.
 
     Args:
         pdf_path (str): The file path to the PDF document to be processed.
 
     Returns:
-        list: A list of base64-encoded strings, where each string represents
+        list: A list of base64 data URLs, where each string represents
               a page of the PDF as a PNG image.
     Example:
         ```python
@@ -57,7 +63,7 @@ def to_base64(pdf_path: str) -> list:
         pix = page.get_pixmap(dpi=300)
         
         img_bytes = pix.tobytes("png")
-        base64_str = base64.b64encode(img_bytes).decode("utf-8")
+        base64_str = "data:image/png;base64," + base64.b64encode(img_bytes).decode("utf-8")
         images.append(base64_str)
 
     return images
@@ -65,17 +71,18 @@ def to_base64(pdf_path: str) -> list:
 
 def base_64_conversation(input_type: str = "PDF", file_path: str = "") -> list:
     """
-    Converts a PDF or image file to base64-encoded string(s).
+    Converts a PDF or image file to base64 data URL(s).
 
     For PDF files, each page is converted into a base64-encoded PNG image.
     For image files, the entire image is encoded as a single base64 string.
+    Each string is already prefixed with `data:<mime>;base64,` so callers can use it directly.
 
     Args:
         input_type (str): The type of input file. Accepted values are "PDF" and "IMAGE".
         file_path (str): The path to the file to be converted.
 
     Returns:
-        list: A list of base64-encoded strings. For PDFs, each list item represents
+        list: A list of base64 data URLs. For PDFs, each list item represents
               a page. For images, the list contains a single base64 string.
 
     Raises:
@@ -94,11 +101,80 @@ def base_64_conversation(input_type: str = "PDF", file_path: str = "") -> list:
         base64_pdf_pages = to_base64(file_path)
         return base64_pdf_pages
     elif input_type == "IMAGE":
-        return [encode_image(file_path)]
+        mime_type = mimetypes.guess_type(file_path)[0] or "image/jpeg"
+        return [f"data:{mime_type};base64,{encode_image(file_path)}"]
     else:
         raise ValueError("Unsupported file type. Use 'PDF' or 'IMAGE'.")
 
 
+def file_sha256(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 hex digest of a file's contents, reading it in chunks.
+
+    Args:
+        file_path (str): The path to the file to hash.
+        chunk_size (int): Number of bytes read per chunk.
+
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_base_64_conversation(input_type: str = "PDF", file_path: str = "", cache_dir: str = BASE64_CACHE_DIR) -> list:
+    """
+    Same as `base_64_conversation`, but caches the result on disk keyed by the SHA-256
+    of the file contents, so re-extracting an unchanged file skips rasterization.
+
+    Args:
+        input_type (str): The type of input file. Accepted values are "PDF" and "IMAGE".
+        file_path (str): The path to the file to be converted.
+        cache_dir (str): Directory holding the cached base64 pages.
+
+    Returns:
+        list: A list of base64-encoded strings, as returned by `base_64_conversation`.
+
+    Raises:
+        ValueError: If the input type is not supported.
+        FileNotFoundError: If the specified file does not exist.
+
+    Example:
+        ```python
+        base64_images = cached_base_64_conversation(input_type="PDF", file_path="documents/sample.pdf")
+        ```
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"The file {file_path} does not exist.")
+
+    cache_path = os.path.join(cache_dir, f"{input_type.lower()}-dataurl-{file_sha256(file_path)}.json")
+    try:
+        with open(cache_path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        pass
+
+    base64_pages = base_64_conversation(input_type=input_type, file_path=file_path)
+
+    # The cache is best-effort: a failed store must not fail the conversion itself
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a unique temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(base64_pages))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return base64_pages
+
+
 if __name__ == "__main__":
     # Example usage
     # base64_images = base_64_conversation(input_type="PDF", file_path="/home/murari/Desktop/extract/ec_documents/152.pdf")